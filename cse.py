@@ -6,24 +6,98 @@ relies on the use of a set ssh key to interact with
 the cse servers.
 """
 
-import argparse
+import asyncio
 import datetime
+import functools
 import json
 import os
+import re
+import selectors
 import subprocess
 import sys
-import time
+import types
 
-from helper import DATEFRMT, color_print, header_print, prog_print
+from helper import DATEFRMT, PROG, color_print, header_print, prog_print
 
-try:
-    from dotenv import dotenv_values
-except ImportError:
-    sys.exit("%s: python-dotenv is required." % (os.path.basename(sys.argv[0])))
 
+def _die(msg: str) -> None:
+    """Exit with a message prefixed by the program name"""
+    sys.exit(f"{PROG}: {msg}")
 
-def parse_args() -> None:
-    """Command line argument parser."""
+
+@functools.cache
+def load_config() -> types.SimpleNamespace:
+    """Load and validate the cse settings, only once and only when needed"""
+    try:
+        from dotenv import dotenv_values
+    except ImportError:
+        _die("python-dotenv is required.")
+
+    configuration = dotenv_values(HOME + "/.config/.env")
+    if not configuration:
+        _die(".env configuration file is required.")
+    local = configuration.get("CSE_LOCAL_PATH")
+    if not local:
+        _die("CSE_LOCAL_PATH missing from .env")
+    remote = configuration.get("CSE_PATH")
+    if not remote:
+        _die("CSE_PATH missing from .env")
+    folder = os.getcwd().removeprefix(local)
+    return types.SimpleNamespace(
+        local=local,
+        remote=remote,
+        bwlimit=configuration.get("CSE_BWLIMIT"),
+        folder=folder,
+        in_cse_folder=os.getcwd() != folder,
+    )
+
+
+def fast_parse_args(argv: list):
+    """Parse the common cse invocations without building argparse parsers.
+
+    Returns None for anything else, such as help, unknown or conflicting
+    flags, so that the caller falls back to parse_args."""
+    if not argv or argv[0] not in FAST_FLAGS:
+        return None
+    subcommand, *rest = argv
+    switches, defaults, exclusive, nargs = FAST_FLAGS[subcommand]
+    values = dict(defaults)
+    positional_args = []
+    positionals_closed = False
+    while rest:
+        arg = rest.pop(0)
+        if not arg.startswith("-"):
+            # argparse only accepts a single run of positional arguments
+            if positionals_closed:
+                return None
+            positional_args.append(arg)
+            continue
+        positionals_closed = bool(positional_args)
+        dest = switches.get(arg)
+        if dest is None:
+            return None
+        if dest in nargs:
+            if len(rest) < nargs[dest] or any(
+                a.startswith("-") for a in rest[: nargs[dest]]
+            ):
+                return None
+            taken, rest = rest[: nargs[dest]], rest[nargs[dest] :]
+            values[dest] = taken if nargs[dest] > 1 else taken[0]
+        else:
+            values[dest] = True
+    if all(values[dest] for dest in exclusive):
+        return None
+    return types.SimpleNamespace(
+        subcommand=subcommand,
+        **values,
+        positional_args=positional_args,
+        func=cse_run if subcommand == "run" else cse_sync,
+    )
+
+
+def parse_args() -> tuple:
+    """Command line argument parser, returns the parser with its arguments."""
+    import argparse  # only needed for help and uncommon invocations
 
     parent_parser_flags = argparse.ArgumentParser(add_help=False)
     parent_parser_flags.add_argument(
@@ -67,6 +141,16 @@ def parse_args() -> None:
         action="store_true",
         help="sync from cse to local environment",
     )
+    cse_sync_parser.add_argument(
+        "--bwlimit",
+        metavar="<rate>",
+        help="limit rsync bandwidth, overrides CSE_BWLIMIT in .env",
+    )
+    cse_sync_parser.add_argument(
+        "--checksum",
+        action="store_true",
+        help="compare file contents instead of size and modification time",
+    )
     cse_sync_parser.add_argument("positional_args", nargs="*")
 
     parent_parser = argparse.ArgumentParser(
@@ -90,65 +174,148 @@ def parse_args() -> None:
     )
     cse_sync_subcommand.set_defaults(func=cse_sync)
 
-    return parent_parser.parse_args()
+    return parent_parser, parent_parser.parse_args()
 
 
 def display_output(lines: str) -> None:
     """Display received response from cse servers."""
-    for _ in lines.split("\n"):
-        print(" ", _)
+    sys.stdout.write("  " + lines.replace("\n", "\n  ") + "\n")
 
 
 def output_file(*args: tuple) -> None:
     """Create cse.out file."""
     time = datetime.datetime.now().strftime(DATEFRMT)
     with open(f"{os.getcwd()}/cse.out", "w") as f:
-        print(time, file=f)
-        for _ in args:
-            print(_, file=f)
+        f.write("\n".join(map(str, (time, *args))) + "\n")
     print("  output saved to 'cse.out'")
 
 
-def execute_and_stream(command: list, streaming: bool) -> str:
-    """spawns a subprocess to run cse commands and streams output."""
+def execute_and_stream(
+    command: list, streaming: bool = False, stdin_data: str | None = None
+) -> tuple:
+    """spawns a subprocess to run cse commands and optionally streams output."""
     response = subprocess.Popen(
         command,
+        stdin=subprocess.PIPE if stdin_data is not None else None,
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
-        encoding="utf-8",
+        bufsize=0,
     )
-    start_time = time.time()
-    output = ""
-    while True:
-        if time.time() - start_time >= TIMEOUT:
-            output = "request timed out"
-            response.kill()
-            break
-        if response.stdout.readable():
-            line = response.stdout.readline()
-            output += line
-            if not line:
+    output = bytearray()
+    pending = b""
+    timed_out = False
+    done = False
+    with selectors.DefaultSelector() as selector:
+        selector.register(response.stdout, selectors.EVENT_READ)
+        if stdin_data is not None:
+            # stdin is fed alongside the reads so a full pipe never blocks us
+            data = memoryview(stdin_data.encode())
+            os.set_blocking(response.stdin.fileno(), False)
+            selector.register(response.stdin, selectors.EVENT_WRITE)
+        while not done:
+            # wake on new output or give up after TIMEOUT seconds of silence
+            events = selector.select(TIMEOUT)
+            if not events:
+                timed_out = True
+                response.kill()
                 break
-            if streaming:
-                print(" ", line.strip())
-            start_time = time.time()
-    print()
-    return output, response.returncode == 0
+            for key, _ in events:
+                if key.fileobj is response.stdin:
+                    try:
+                        data = data[os.write(key.fd, data[:CHUNK_SIZE]) :]
+                    except BlockingIOError:
+                        continue
+                    except BrokenPipeError:
+                        # the child exited early, its output tells why
+                        data = data[:0]
+                    if not data:
+                        selector.unregister(response.stdin)
+                        response.stdin.close()
+                    continue
+                chunk = response.stdout.read(CHUNK_SIZE)
+                if not chunk:
+                    done = True
+                    break
+                output += chunk
+                if streaming:
+                    # print complete lines only, partial lines wait for the next chunk
+                    *lines, pending = (pending + chunk).split(b"\n")
+                    for line in lines:
+                        print(" ", line.decode(errors="replace").strip())
+    if response.stdin and not response.stdin.closed:
+        try:
+            response.stdin.close()
+        except BrokenPipeError:
+            pass
+    if streaming and pending:
+        print(" ", pending.decode(errors="replace").strip())
+    response.wait()
+    if streaming:
+        print()
+    if timed_out:
+        return "request timed out", False
+    return output.decode(errors="replace"), response.returncode == 0
+
+
+def remote_command(line: str) -> list:
+    """Build the ssh command line used to run a command on the cse server"""
+    config = load_config()
+    return (
+        [*SSH_COMMAND, "cse", f'COMP; cd {config.folder.lstrip("/")}; ' + line]
+        if config.in_cse_folder and config.folder
+        else [*SSH_COMMAND, "cse", f"COMP; {line}"]
+    )
 
 
 def cse_execute(line: str, output=True):
     """Execute commands on the cse server"""
     if output:
         header_print(line)
-    line = (
-        ["ssh", "cse", f'COMP; cd {FOLDER.lstrip("/")}; ' + line]
-        if IN_CSE_FOLDER and FOLDER
-        else ["ssh", "cse", f"COMP; {line}"]
-    )
-    output, success = execute_and_stream(line, output)
+    output, success = execute_and_stream(remote_command(line), output)
     return output, success
 
 
+def open_control_master() -> None:
+    """Start the shared ssh connection so concurrent commands can reuse it"""
+    check = [*SSH_COMMAND, "-O", "check", "cse"]
+    try:
+        if subprocess.run(check, capture_output=True, timeout=TIMEOUT).returncode == 0:
+            return
+        # the master outlives this command for ControlPersist, detach its output
+        # so we do not wait on it. If this fails each command connects by itself
+        subprocess.run(
+            [*SSH_COMMAND, "cse", "true"],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            timeout=TIMEOUT,
+        )
+    except subprocess.TimeoutExpired:
+        # likewise, each command then connects under its own timeout
+        pass
+
+
+async def cse_execute_async(line: str):
+    """Execute a command on the cse server without streaming its output"""
+    process = await asyncio.create_subprocess_exec(
+        *remote_command(line),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+    )
+    try:
+        stdout, _ = await asyncio.wait_for(process.communicate(), TIMEOUT)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        return "request timed out", False
+    return stdout.decode("utf-8", errors="replace"), process.returncode == 0
+
+
+async def cse_execute_all(lines: list) -> list:
+    """Execute several commands on the cse server concurrently"""
+    return await asyncio.gather(*(cse_execute_async(line) for line in lines))
+
+
 def cse_run(args) -> None:
     """Processes a command executed on the cse server"""
 
@@ -172,80 +339,79 @@ def cse_run(args) -> None:
         if not pos_args:
             prog_print("expected arguments [ list ... <class> ]")
             return
-        output = ""
-        for c in pos_args:
-            response, success = cse_execute(f"{c} classrun -sturec")
-            if flagc:
-                output = output + "\n" + response
-                continue
+        lines = [f"{c} classrun -sturec" for c in pos_args]
+        if len(lines) > 1:
+            # otherwise every concurrent ssh races to become the master
+            open_control_master()
+        responses = asyncio.run(cse_execute_all(lines))
+        # requests run concurrently, results are displayed in argument order
+        for line, (response, success) in zip(lines, responses):
+            header_print(line)
+            display_output(response)
         if flagc:
-            output_file()
-            with open("cse.out", "a") as f:
-                print(output, f)
+            output_file(*(response for response, _ in responses))
     else:
         output, success = cse_execute(" ".join(pos_args))
         if flagc:
             output_file(output)
 
 
-def is_directory(files, filename):
-    """Filters the output of ls -al from subprocess to check for
-    whether the specified file is a directory"""
-    is_directory = False
-    for f in files:
-        line = f.split()
-        if line[0][0] == "d" and line[-1] == filename:
-            is_directory = True
-    return is_directory
-
-
-def exists(files, filename):
-    """Checks the output of ls -al from subprocess to see if a file matching
-    the filename is found"""
-    exists = False
-    for f in files:
-        if f.split()[-1] == filename:
-            exists = True
-    return exists
+def parse_ls(listing: str) -> dict:
+    """Map each name in the output of ls -al to its file type character"""
+    return {m["name"]: m["type"] for m in LS_PATTERN.finditer(listing)}
 
 
 def cse_sync(args) -> None:
     """Sync information between local and the cse server"""
-    flagc, flagf, flagd, pos_args = args
+    flagc, flagf, flagd, bwlimit, checksum, pos_args = args
 
-    if not IN_CSE_FOLDER:
+    config = load_config()
+    if not config.in_cse_folder:
         prog_print("cse sync should only be used in the local cse folder")
         return
 
+    cwd = os.getcwd().removeprefix(UNSW_CSE_PREFIX)
+    bwlimit = bwlimit or config.bwlimit
+    # size and mtime are enough to spot changes unless contents are requested
+    options = ["--checksum"] if checksum else []
+    if bwlimit:
+        options.append(f"--bwlimit={bwlimit}")
+
     if flagd:  # syncs a cse file or directory ==> local
-        cwd = os.getcwd().replace(os.path.expandvars("$HOME") + "/unsw/cse", "")
-        for item in pos_args:
-            base_path = configuration.get("CSE_LOCAL_PATH")
-            course_path = f"{base_path}{cwd}/{item}"
-            cse_course_path = f"{configuration.get('CSE_PATH')}{cwd}/{item}"
+        # list the remote folder once, mapping each name to its file type
+        listing, success = cse_execute("ls -al", False)
+        if not success:
+            # every item would otherwise be reported as missing
+            prog_print("unable to list the cse folder.")
+            display_output(listing)
+            return
+        entries = parse_ls(listing)
 
-            # check if directory
-            dir_files = list(
-                filter(lambda x: x != "", cse_execute("ls -al", False)[0].split("\n"))
-            )
+        for item in pos_args:
+            course_path = f"{config.local}{cwd}/{item}"
+            cse_course_path = f"{config.remote}{cwd}/{item}"
 
             # rsync will otherwise sync the directory as a sub directory
-            if is_directory(dir_files, item):
+            if entries.get(item) == "d":
                 cse_course_path += "/"
                 course_path += "/"
 
             command = [
                 "rsync",
                 "-ani",
+                *options,
+                "-e",
+                RSYNC_SSH,
                 cse_course_path,
                 course_path,
             ]
 
-            response = subprocess.run(
-                command, capture_output=True, encoding="utf-8"
-            ).stdout
+            response, success = execute_and_stream(command)
 
-            if response:
+            if not success and item in entries:
+                prog_print(f"unable to compare '{item}' with cse.")
+                display_output(response)
+            elif success and response:
                 color_print(
                     f"==> downloading '{item}' from cse to local computer:\n",
                 )
@@ -253,87 +419,166 @@ def cse_sync(args) -> None:
                 if not flagf and input("==> process? ") in ("yes", "y", "Yes"):
                     command = [
                         "rsync",
-                        "-aviP",
+                        "-aviPz",
+                        *options,
+                        "-e",
+                        RSYNC_SSH,
                         cse_course_path,
                         course_path,
                     ]
-                    response, success = execute_and_stream(command)
+                    response, success = execute_and_stream(command, True)
             else:
                 prog_print(
                     f"no changes to '{item}'."
-                    if exists(dir_files, item)
+                    if item in entries
                     else f"'{item}' does not exist."
                 )
         return
 
-    for f in pos_args:  # syncs a local file or directory ==> cse
-        if not os.path.exists(os.getcwd() + r"/" + f):
+    files = []
+    for f in pos_args:  # syncs local files or directories ==> cse
+        if not os.path.exists(f):
             prog_print(f"'{f}' not found in current directory.")
             continue
+        files.append(f)
 
-        cwd = os.getcwd().replace(os.path.expanduser("~") + "/unsw/cse", "")
-        cse_path = CSE + cwd
+    if not files:
+        return
 
-        if os.path.isfile(f):
-            cse_path = cse_path + f"/{f}"
+    cse_path = config.remote + cwd
+
+    # a single dry run over every file, relative paths are kept by --files-from
+    command = [
+        "rsync",
+        "-anir",
+        *options,
+        "--files-from=-",
+        "-e",
+        RSYNC_SSH,
+        ".",
+        cse_path,
+    ]
+    response, success = execute_and_stream(command, stdin_data="\n".join(files))
+    if not success:
+        prog_print("unable to compare files with cse.")
+        return
 
-        command = ["rsync", "-acin", f, cse_path]
-        response = subprocess.run(command, capture_output=True, encoding="utf-8").stdout
+    # attribute each itemized change back to the most specific argument it
+    # came from, so 'sub/d' keeps its changes when 'sub' is also given
+    changes = {f: [] for f in files}
+    prefixes = sorted(
+        ((f, os.path.normpath(f)) for f in files),
+        key=lambda item: -1 if item[1] == "." else len(item[1]),
+        reverse=True,
+    )
+    for line in response.splitlines():
+        name = line.partition(" ")[2].rstrip("/")
+        for f, prefix in prefixes:
+            if prefix == "." or name == prefix or name.startswith(prefix + "/"):
+                changes[f].append(line)
+                break
 
-        if response:
-            color_print(f"==> uploading '{f}' from local computer to cse:")
-            display_output(response)
-            response = ""
-            return_code = 1
-            process = False
-            if not flagf and input("==> process? ") in ("yes", "y", "Yes"):
-                process = True
-                color_print(f"==> uploading '{f}'")
-                response, return_code = execute_and_stream(
-                    ["rsync", "-acivP", f, cse_path]
-                )
-            if flagf:
-                process = True
-                color_print(f"==> uploading '{f}'\n")
-                response, return_code = execute_and_stream(
-                    ["rsync", "-acivP", f, cse_path]
-                )
+    confirmed = []
+    for f in files:
+        if not changes[f]:
+            print(f"no changes to '{f}'")
+            continue
+        color_print(f"==> uploading '{f}' from local computer to cse:")
+        display_output("\n".join(changes[f]))
+        if flagf or input("==> process? ") in ("yes", "y", "Yes"):
+            confirmed.append(f)
 
-            if return_code != 0 and process:
-                color_print(f"==> {f} is up to date")
+    if not confirmed:
+        return
 
-        else:
-            print(f"no changes to '{f}'")
+    color_print(f"==> uploading {', '.join(repr(f) for f in confirmed)}\n")
+    command = [
+        "rsync",
+        "-avirPWz",
+        *options,
+        "--files-from=-",
+        "-e",
+        RSYNC_SSH,
+        ".",
+        cse_path,
+    ]
+    response, success = execute_and_stream(command, True, "\n".join(confirmed))
+    if not success:
+        prog_print("failed to upload files.")
 
 
 TIMEOUT: int = 60
-
-configuration = dotenv_values(os.path.expandvars("$HOME") + "/.config/.env")
-if configuration:
-    if not (configuration.get("CSE_LOCAL_PATH")):
-        sys.exit(
-            "%s: CSE_LOCAL_PATH missing from .env" % (os.path.basename(sys.argv[0]))
-        )
-    FOLDER = (
-        os.getcwd().replace(configuration.get("CSE_LOCAL_PATH"), "")
-        if configuration.get("CSE_LOCAL_PATH")
-        else None
-    )
-    CSE = configuration.get("CSE_PATH") if configuration.get("CSE_PATH") else None
-    IN_CSE_FOLDER: bool = os.getcwd() != FOLDER
-    if not (CSE):
-        sys.exit("%s: CSE_PATH missing from .env" % (os.path.basename(sys.argv[0])))
-else:
-    sys.exit(
-        "%s: .env configuration file is required." % (os.path.basename(sys.argv[0]))
-    )
+# mode, links, owner, group, size, month, day, time then the name
+LS_PATTERN = re.compile(
+    r"^(?P<type>\S)\S*(?:[ \t]+\S+){7}[ \t]+(?P<name>.+?)(?: -> .*)?$", re.MULTILINE
+)
+CHUNK_SIZE: int = 16384
+
+# multiplex every ssh and rsync call over a single persistent connection
+SSH_COMMAND: list = [
+    "ssh",
+    "-o",
+    "ControlMaster=auto",
+    "-o",
+    "ControlPath=~/.ssh/cm-%C",
+    "-o",
+    "ControlPersist=10m",
+]
+RSYNC_SSH: str = " ".join(SSH_COMMAND)
+
+# subcommand => (flag to dest, defaults, mutually exclusive dests, value counts)
+FAST_FLAGS: dict = {
+    "run": (
+        {
+            "-c": "copy",
+            "--copy": "copy",
+            "--debug": "debug",
+            "-a": "autotest",
+            "--autotest": "autotest",
+            "-s": "sturec",
+            "--sturec": "sturec",
+        },
+        {"copy": False, "debug": False, "autotest": None, "sturec": False},
+        ("autotest", "sturec"),
+        {"autotest": 2},
+    ),
+    "sync": (
+        {
+            "-c": "copy",
+            "--copy": "copy",
+            "--debug": "debug",
+            "-f": "force",
+            "--force": "force",
+            "-d": "download",
+            "--download": "download",
+            "--bwlimit": "bwlimit",
+            "--checksum": "checksum",
+        },
+        {
+            "copy": False,
+            "debug": False,
+            "force": False,
+            "download": False,
+            "bwlimit": None,
+            "checksum": False,
+        },
+        ("force", "download"),
+        {"bwlimit": 1},
+    ),
+}
+
+HOME: str = os.path.expanduser("~")
+UNSW_CSE_PREFIX: str = HOME + "/unsw/cse"
 
 if __name__ == "__main__":
     try:
-        args = parse_args()
-        if args.subcommand is None:
-            subprocess.run(["cse", "-h"])
-            sys.exit(1)
+        args = fast_parse_args(sys.argv[1:])
+        if args is None:
+            # the fast path never accepts a missing subcommand
+            parser, args = parse_args()
+            if args.subcommand is None:
+                parser.print_help()
+                sys.exit(1)
         _dict = vars(args)
         flags = (
             _dict[k]
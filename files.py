@@ -13,38 +13,22 @@ except ImportError:
     sys.exit("%s: the dotenv package is required." % (os.path.basename(sys.argv[0])))
 
 import argparse
+import functools
 import json
+import pathlib
+import pickle
+import re
+import shutil
 import subprocess
+import tempfile
 
 from helper import color_print, prog_print
 
 
-def parse_arguments() -> dict:
-    """Command line arguments parser"""
-    parser = argparse.ArgumentParser(
-        allow_abbrev=False,
-        exit_on_error=True,
-        description="Basic file factory for c/c++, python, shell, make and cmake files",
-    )
-    subp = parser.add_subparsers(dest="filetype", title="subcommands", required=True)
-
-    main_flags = argparse.ArgumentParser(add_help=False)
-    main_flags.add_argument(
-        "file_name",
-        nargs="+",
-        help="<program file>, list <dependencies...>",
-    )
-    main_flags.add_argument(
-        "-d", "--debug", action="store_true", help="print debugging related information"
-    )
-    main_flags.add_argument(
-        "-p", "--path", nargs=1, help="provide a path to the configuration file"
-    )
-    # python files
-    subp.add_parser("py", parents=[main_flags], help="file generator for py files")
-    # make/cmake files
-    make_flags = argparse.ArgumentParser(add_help=False)
-    make_flags.add_argument(
+def make_flags() -> argparse.ArgumentParser:
+    """Flags shared by the make and cmake subcommands"""
+    flags = argparse.ArgumentParser(add_help=False)
+    flags.add_argument(
         "-std",
         "--standard",
         nargs=1,
@@ -52,14 +36,41 @@ def parse_arguments() -> dict:
         metavar="<std>",
         help="set standard for compilation",
     )
-    make_flags.add_argument(
+    flags.add_argument(
         "-f", "--flags", nargs=1, type=str, help="replaces compiler flags"
     )
+    return flags
+
+
+def c_flags() -> argparse.ArgumentParser:
+    """Flags shared by the c and cpp subcommands"""
+    flags = argparse.ArgumentParser(add_help=False)
+    flags.add_argument(
+        "-m", "--main", action="store_true", help="include argc and argv in main"
+    )
+    return flags
+
+
+def add_py(subp, main_flags) -> None:
+    """Add the python file subcommand."""
+    subp.add_parser("py", parents=[main_flags], help="file generator for py files")
+
+
+def add_make(subp, main_flags) -> None:
+    """Add the make file subcommand."""
     subp.add_parser(
-        "make", parents=[main_flags, make_flags], help="file generator for cmake files"
+        "make",
+        parents=[main_flags, make_flags()],
+        help="file generator for cmake files",
     )
+
+
+def add_cmake(subp, main_flags) -> None:
+    """Add the cmake file subcommand."""
     cmake = subp.add_parser(
-        "cmake", parents=[main_flags, make_flags], help="file generator for make files"
+        "cmake",
+        parents=[main_flags, make_flags()],
+        help="file generator for make files",
     )
     cmake.add_argument(
         "-t",
@@ -74,19 +85,21 @@ def parse_arguments() -> dict:
         help="remove cmake files",
     )
 
-    # c/cpp files
-    c_flags = argparse.ArgumentParser(add_help=False)
-    c_flags.add_argument(
-        "-m", "--main", action="store_true", help="include argc and argv in main"
-    )
+
+def add_c(subp, main_flags) -> None:
+    """Add the c file subcommand."""
     subp.add_parser(
-        "c", parents=[main_flags, c_flags], help="file generator for c files"
+        "c", parents=[main_flags, c_flags()], help="file generator for c files"
     )
+
+
+def add_cpp(subp, main_flags) -> None:
+    """Add the cpp file subcommand."""
     cpp = subp.add_parser(
         "cpp",
         parents=[
             main_flags,
-            c_flags,
+            c_flags(),
         ],
         help="file generator for cpp files",
     )
@@ -96,138 +109,196 @@ def parse_arguments() -> dict:
         action="store_true",
         help="competitive programming template",
     )
-    # zsh/shell files
+
+
+def add_sh(subp, main_flags) -> None:
+    """Add the shell file subcommand."""
     subp.add_parser("sh", parents=[main_flags], help="file generator for sh files")
+
+
+def add_zsh(subp, main_flags) -> None:
+    """Add the zsh file subcommand."""
     subp.add_parser("zsh", parents=[main_flags], help="file generator for zsh files")
 
+
+SUBCOMMANDS = {
+    "py": add_py,
+    "make": add_make,
+    "cmake": add_cmake,
+    "c": add_c,
+    "cpp": add_cpp,
+    "sh": add_sh,
+    "zsh": add_zsh,
+}
+
+
+def parse_arguments() -> dict:
+    """Command line arguments parser"""
+    parser = argparse.ArgumentParser(
+        allow_abbrev=False,
+        exit_on_error=True,
+        description="Basic file factory for c/c++, python, shell, make and cmake files",
+    )
+    subp = parser.add_subparsers(dest="filetype", title="subcommands", required=True)
+
+    main_flags = argparse.ArgumentParser(add_help=False)
+    main_flags.add_argument(
+        "file_name",
+        nargs="+",
+        help="<program file>, list <dependencies...>",
+    )
+    main_flags.add_argument(
+        "-d", "--debug", action="store_true", help="print debugging related information"
+    )
+    main_flags.add_argument(
+        "-p", "--path", nargs=1, help="provide a path to the configuration file"
+    )
+
+    # only the requested subcommand is built, help and errors need all of them
+    requested = sys.argv[1] if len(sys.argv) > 1 else None
+    for name in [requested] if requested in SUBCOMMANDS else SUBCOMMANDS:
+        SUBCOMMANDS[name](subp, main_flags)
+
     return vars(parser.parse_args())
 
 
-def basic_check(args: dict):
+def check_build_file(args: dict, split_name: list):
+    """make and cmake files are generated from an existing c/c++ source file."""
+    file_n = args["file_name"][0]
+    if not os.path.exists(f"{CWD}/{file_n}"):
+        return False, f"'{file_n}' not found in current directory"
+    if len(split_name) != 2 or split_name[1] not in C_LIKE:
+        return False, f"invalid file '{file_n}'"
+    return True, ""
+
+
+def check_cmake_project(args: dict, split_name: list):
+    """cmake projects are also generated into a fresh src folder."""
+    success, message = check_build_file(args, split_name)
+    # a clean run removes the existing project before generating
+    if success and not args["clean"] and os.path.exists(f"{CWD}/src"):
+        return (
+            False,
+            "existing cmake project exists. Remove all files before continuing.",
+        )
+    return success, message
+
+
+def check_source_file(args: dict, split_name: list):
+    """Source files are named without a suffix, it comes from the filetype."""
+    if len(split_name) == 2:
+        return False, f"extraneous suffix '{split_name[1]}'"
+    return True, ""
+
+
+VALIDATORS = {
+    "py": check_source_file,
+    "make": check_build_file,
+    "cmake": check_cmake_project,
+    "c": check_source_file,
+    "cpp": check_source_file,
+    "sh": check_source_file,
+    "zsh": check_source_file,
+}
+
+
+def basic_check(args: dict, split_name: list):
     """Check validity of arguments."""
-    success = True
-    err_message = ""
-    file_t, file_n = args["filetype"], args["file_name"][0]
-    has_suffix = file_n.split(".")
-    # disallow suffixes in file creation
-    if len(has_suffix) == 2 and file_t not in ("cmake", "make"):
-        err_message = f"extraneous suffix '{has_suffix[1]}'"
-        success = False
+    file_t = args["filetype"]
     # configuration must exist
-    try:
-        CONFIG[file_t]
-    except KeyError:
-        success = False
-        err_message = f"no configuration found for '{file_t}'"
-    # file must exist for cmake / make
-    if not os.path.exists(os.getcwd() + f"/{file_n}") and file_t in ("cmake", "make"):
-        success = False
-        err_message = f"'{file_n}' not found in current directory"
-    return success, err_message
+    if file_t not in CONFIG:
+        return False, f"no configuration found for '{file_t}'"
+    return VALIDATORS[file_t](args, split_name)
 
 
-def remove_all_files(path):
-    if os.path.exists(path):
-        for file_name in os.listdir(path):
-            # construct full file path
-            file = path + "/" + file_name
-            if os.path.isfile(file):
-                print("Deleting file:", file)
-                os.remove(file)
-        os.rmdir(path)
+@functools.lru_cache(maxsize=None)
+def placeholder_pattern(placeholders: tuple) -> re.Pattern:
+    """Compile a single alternation matching any of the placeholders."""
+    # longest first so that a placeholder never shadows a longer one
+    ordered = sorted(placeholders, key=len, reverse=True)
+    return re.compile("|".join(map(re.escape, ordered)))
 
 
-def cmake_factory(args: dict, file_content: dict) -> str:
-    """Generate a cmake file."""
-    contents = ""
-    file_n = args["file_name"][0]
-    if len(file_n.split(".")) != 2:
-        prog_print(f"invalid file '{file_n}'")
-        return contents
+def fill_template(template: str, replacements: dict) -> str:
+    """Substitute every placeholder of a template in one pass."""
+    pattern = placeholder_pattern(tuple(replacements))
+    return pattern.sub(lambda match: replacements[match.group()], template)
 
-    if args["clean"]:
-        remove_all_files(os.getcwd() + "/src")
-        remove_all_files(os.getcwd() + "/build")
-        remove_all_files(os.getcwd() + "/include")
 
-    if os.path.exists(os.getcwd() + "/src"):
-        prog_print(
-            "existing cmake project exists. Remove all files before continuing.",
-        )
-        return contents
+def remove_all_files(path):
+    if os.path.exists(path):
+        # scandir entries carry the file type, so no stat per file is needed
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    print("Deleting file:", entry.path)
+                    os.remove(entry.path)
+        os.rmdir(path)
 
-    filename, suffix = args["file_name"][0].split(".")
 
-    if suffix not in ("c", "cpp"):
-        prog_print(f"invalid file '{file_n}'")
-        return contents
+def cmake_factory(args: dict, file_content: dict, split_name: list) -> str:
+    """Generate a cmake file, the arguments are checked by basic_check."""
+    if args["clean"]:
+        remove_all_files(f"{CWD}/src")
+        remove_all_files(f"{CWD}/build")
+        remove_all_files(f"{CWD}/include")
 
-    contents = "".join(file_content["cmake"]["p1"])
+    filename, suffix = split_name
+    contents = file_content["cmake"]["p1"]
 
+    # the test block holds placeholders of its own, so it is spliced in first
     if args["tests"]:
         contents = contents.replace(
-            "add_executable(main ${SRC_FILES})", "".join(file_content["cmake"]["tests"])
+            "add_executable(main ${SRC_FILES})", file_content["cmake"]["tests"]
         )
-    contents = contents.replace("$FILENAME", f"src/{filename}").replace(
-        "$SUFFIX", suffix
-    )
+    replacements = {"$FILENAME": f"src/{filename}", "$SUFFIX": suffix}
 
     if suffix == "cpp" and args["standard"]:
-        contents = contents.replace("c++20", f"c++{args['standard']}")
+        replacements["c++20"] = f"c++{args['standard'][0]}"
 
     if suffix == "c":
-        contents = contents.replace(
-            "set(CMAKE_CXX_STANDARD 20)", "set(CMAKE_CXX_STANDARD 99)"
-        )
+        replacements["set(CMAKE_CXX_STANDARD 20)"] = "set(CMAKE_CXX_STANDARD 99)"
         if args["standard"]:
-            contents = contents.replace("c99", "c" + args["standard"])
-    return contents
+            replacements["c99"] = "c" + args["standard"][0]
+    return fill_template(contents, replacements)
 
 
-def generate_file(args: dict, file_content: dict) -> str:
+def generate_file(args: dict, file_content: dict, split_name: list) -> str:
     """Generate the file contents to be written."""
     contents: str = ""
-    success, message = basic_check(args)
-    if not success:
-        prog_print(message)
-        return contents
-
     try:
         file_t = args["filetype"]
 
         if file_t == "py":
-            contents = "".join(file_content["py"]["p1"])
+            contents = file_content["py"]["p1"]
 
-        if file_t == "c" or file_t == "cpp":
+        if file_t in C_LIKE:
             if file_t == "c":
                 c = file_content["c"]
-                contents = "".join(c["p1"])
+                contents = c["p1"]
                 if args["main"]:
-                    contents = "".join(c["p2"])
+                    contents = c["p2"]
             else:
                 cpp = file_content["cpp"]
-                contents = "".join(cpp["p1"])
+                contents = cpp["p1"]
                 if args["competitive"]:
-                    contents = (
-                        "".join(cpp["p2.m"]) if args["main"] else "".join(cpp["p2"])
-                    )
+                    contents = cpp["p2.m"] if args["main"] else cpp["p2"]
                 elif args["main"]:
-                    contents = "".join(cpp["p1.m"])
+                    contents = cpp["p1.m"]
 
-        if file_t == "sh" or file_t == "zsh":
+        if file_t in SHELL_LIKE:
             contents = file_content[file_t]["p1"]
 
         if file_t == "make":
-            filename, suffix = args["file_name"][0].split(".")
-            contents = "".join(file_content["make"][f"p1.{suffix}"])
-            contents = contents.replace("$FILENAME", filename).replace(
-                "$SUFFIX", suffix
-            )
+            filename, suffix = split_name
+            contents = file_content["make"][f"p1.{suffix}"]
+            replacements = {"$FILENAME": filename, "$SUFFIX": suffix}
             if args["standard"]:
-                contents = contents.replace("c++20", f'c++{args["standard"][0]}')
+                replacements["c++20"] = f'c++{args["standard"][0]}'
+            contents = fill_template(contents, replacements)
 
         if file_t == "cmake":
-            contents = cmake_factory(args, file_content)
+            contents = cmake_factory(args, file_content, split_name)
     except KeyError:
         prog_print(f"missing template for {file_t}")
         contents = ""
@@ -235,23 +306,71 @@ def generate_file(args: dict, file_content: dict) -> str:
     return contents
 
 
+def find_config() -> str:
+    """Locate the template file, the user config wins over any project config."""
+    user_config = os.path.expandvars("$HOME") + "/.config/files/files.json"
+    if os.path.exists(user_config):
+        return user_config
+    # otherwise use the closest ancestor holding a src/.files.json
+    dir_path = CWD.split("/")
+    while len(dir_path) > 2:
+        base = "/".join(dir_path)
+        if os.path.isfile(base + "/src/.files.json"):
+            return base + "/src/.files.json"
+        dir_path.pop(-1)
+    return None
+
+
+def load_config(path: str) -> dict:
+    """Load the template config, reusing a pickled copy while it is unchanged."""
+    st = os.stat(path)
+    prefix = f"{st.st_dev}-{st.st_ino}-"
+    cache = f"{CACHE_DIR}/{prefix}{st.st_mtime_ns}-{st.st_size}.v2.pickle"
+    try:
+        with open(cache, "rb") as f:
+            return pickle.load(f)
+    except Exception:  # a damaged cache of any kind falls back to the json
+        pass
+
+    with open(path) as f:
+        config = json.load(f)
+    # templates are stored as lists of lines, join them once for every run
+    for templates in config.values():
+        if isinstance(templates, dict):
+            for key, parts in templates.items():
+                if isinstance(parts, list):
+                    templates[key] = "".join(parts)
+    # caching is best effort, a failure only costs the next run a json parse
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        for name in os.listdir(CACHE_DIR):
+            # temporary files of concurrent runs never carry the prefix
+            if name.startswith(prefix):
+                try:
+                    os.remove(f"{CACHE_DIR}/{name}")
+                except FileNotFoundError:
+                    pass
+        # a unique temporary name keeps concurrent writers apart
+        with tempfile.NamedTemporaryFile(
+            dir=CACHE_DIR, prefix=".tmp-", delete=False
+        ) as f:
+            try:
+                pickle.dump(config, f, protocol=pickle.HIGHEST_PROTOCOL)
+            except OSError:
+                os.remove(f.name)
+                raise
+        os.replace(f.name, cache)
+    except OSError:
+        pass
+    return config
+
+
+CWD = os.getcwd()
+CACHE_DIR = os.path.expandvars("$HOME") + "/.cache/files"
 CONFIG = {}
-dir_path = os.getcwd().split("/")
-path_length = len(dir_path)
-if os.path.exists(os.path.expandvars("$HOME") + "/.config/files/files.json"):
-    configuration_found = True
-    with open(os.path.expandvars("$HOME") + "/.config/files/files.json") as f:
-        CONFIG = json.load(f)
-while path_length > 2 and not CONFIG:
-    curr_files = os.listdir("/".join(dir_path))
-    if "src" in curr_files:
-        config_local = "/".join(dir_path) + "/src/.files.json"
-        if os.path.exists(config_local):
-            configuration_found = True
-            with open(config_local) as f:
-                CONFIG = json.load(f)
-    dir_path.pop(-1)
-    path_length = len(dir_path)
+config_path = find_config()
+if config_path:
+    CONFIG = load_config(config_path)
 
 load_env = dotenv_values(f'{os.path.expandvars("$HOME")}/.config/files/.files')
 CATCH2_FOLDER = load_env["CATCH2_PATH"] if load_env else None
@@ -264,6 +383,9 @@ NAME_CONVERSIONS = {
     "cmake": "CMakeLists.txt",
     "make": "Makefile",
 }
+C_LIKE = frozenset(("c", "cpp"))
+SHELL_LIKE = frozenset(("sh", "zsh"))
+EXECUTABLES = frozenset(("py", "sh", "zsh"))
 
 
 def main() -> None:
@@ -272,53 +394,81 @@ def main() -> None:
         color_print("Provided arguments:")
         for arg in opts:
             print(f"{arg}:", opts[arg])
-    file_contents = generate_file(opts, CONFIG)
-
-    if not file_contents:
-        return
 
     new_file, suffix = opts["file_name"][0], opts["filetype"]
     file_n = f"{new_file}.{suffix}"
-    if os.path.exists(os.path.abspath(file_n)) and input(
-        f"File exists. Replace {os.path.basename(file_n)}? "
-    ) not in ("yes", "y", "Yes"):
-        print("file creation aborted")
-        return
     filename = NAME_CONVERSIONS.get(suffix) if NAME_CONVERSIONS.get(suffix) else file_n
+    # split once, the checks, templates and test setup all reuse it
+    split_name = new_file.split(".")
+    # the checks only stat, so they run before asking to overwrite
+    success, message = basic_check(opts, split_name)
+    if not success:
+        prog_print(message)
+        return
+
+    # confirm before any template work is done
+    exists = os.path.exists(os.path.abspath(filename))
+    if exists:
+        answer = input(f"File exists. Replace {os.path.basename(filename)}? ")
+        if answer not in ("yes", "y", "Yes"):
+            print("file creation aborted")
+            return
 
-    with open(filename, "w") as w:
-        w.write(file_contents)
+    file_contents = generate_file(opts, CONFIG, split_name)
 
-    if suffix in ["zsh", "sh", "py"]:
-        # allow the file to be executable
-        subprocess.run(["chmod", "+x", filename])
+    if not file_contents:
+        return
+
+    # scripts are created executable, the umask still applies
+    executable = suffix in EXECUTABLES
+    fd = os.open(
+        filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o777 if executable else 0o666
+    )
+    try:
+        if executable and exists:
+            # the creation mode is ignored for a file that is replaced, so
+            # only the exec bits the umask allows are added by hand
+            umask = os.umask(0)
+            os.umask(umask)
+            os.fchmod(fd, os.fstat(fd).st_mode | (0o111 & ~umask))
+        data = memoryview(file_contents.encode())
+        while data:
+            data = data[os.write(fd, data) :]
+    finally:
+        os.close(fd)
 
     if suffix == "cmake":
         # create required folders
-        subprocess.run(["mkdir", "build"])
-        subprocess.run(["mkdir", "src"])
-        subprocess.run(["mkdir", "include"])
+        for folder in ("build", "src", "include"):
+            os.makedirs(folder, exist_ok=True)
 
         # move file to the src folder
-        os.rename(os.getcwd() + f"/{new_file}", os.getcwd() + f"/src/{new_file}")
+        os.rename(f"{CWD}/{new_file}", f"{CWD}/src/{new_file}")
 
         # set up testing functionality
         if opts["tests"]:
-            if not os.path.exists(os.getcwd() + "/lib"):
-                # copy folder into cwd and filter out git related files
-                subprocess.run(
-                    ["rsync", "-rv", "-f- .git", "-f- README.md", CATCH2_FOLDER, "."]
+            if not os.path.exists(f"{CWD}/lib"):
+                # copy folder into cwd and filter out git related files, a
+                # trailing slash copies the contents like rsync would
+                shutil.copytree(
+                    CATCH2_FOLDER,
+                    os.path.basename(CATCH2_FOLDER) or ".",
+                    ignore=shutil.ignore_patterns(".git", "README.md"),
+                    dirs_exist_ok=True,
                 )
-            fname, fsuffix = new_file.split(".")
+            fname, fsuffix = split_name
             testfile = new_file.replace(fsuffix, f"test.{fsuffix}")
-            with open(os.getcwd() + f"/src/{testfile}", "a") as f:
+            with open(f"{CWD}/src/{testfile}", "a") as f:
                 print(f'#include "{fname}.{fsuffix.replace("c", "h")}"', file=f)
                 print('#include "catch2/catch.hpp"', file=f)
                 print(file=f)
-            open(  # noqa: SIM115
-                os.getcwd() + f'/include/{fname}.{fsuffix.replace("c", "h")}', "x"
+            pathlib.Path(f'{CWD}/include/{fname}.{fsuffix.replace("c", "h")}').touch(
+                exist_ok=False
             )
-        subprocess.run(["cmake", "-S", ".", "-B", "build/"])
+        # posix_spawn needs an absolute program and no fd close loop, nothing
+        # sensitive is open. A missing cmake still fails as the bare name did
+        cmake = shutil.which("cmake") or "cmake"
+        subprocess.run([cmake, "-S", ".", "-B", "build/"], close_fds=False)
 
     print(f"{filename} created.")
 
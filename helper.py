@@ -4,6 +4,7 @@ import os
 import sys
 
 DATEFRMT = '%d %B %Y %H:%M:%S'
+PROG = os.path.basename(sys.argv[0])
 
 ENDC = '\033[0m'
 BOLD = '\033[1m'
@@ -31,16 +32,15 @@ COLORS: dict = {
 def color_print(msg: str, color: str = 'g', **kwargs) -> None:
     """Color print a message."""
     start = COLORS.get(color, Bcolors.WARNING)
-    print(start + f'{msg}' + ENDC, **kwargs)
+    print(start, msg, ENDC, sep='', **kwargs)
 
 
 def prog_print(msg: str, **kwargs) -> None:
     """Program print a message."""
-    print(f'{os.path.basename(sys.argv[0])}: {msg}', **kwargs)
+    print(f'{PROG}: {msg}', **kwargs)
 
 
 def header_print(msg: str, color='y', **kwargs) -> None:
     """Print a header line."""
     start = COLORS.get(color, Bcolors.WARNING)
-    print('\n' + f'  \033{start}{msg}\n  {"-" * len(msg)}' + ENDC + '\n',
-          **kwargs)
+    print(f'\n  {start}{msg}\n  {"-" * len(msg)}{ENDC}\n', **kwargs)
@@ -10,19 +10,56 @@ TODO:
 """
 
 import argparse
+import functools
 import os
-import subprocess
+import shutil
+import sys
 
-try:
-    from pypdf import PdfMerger, PdfReader, PdfWriter, errors
-except ImportError:
-    import sys
-    sys.exit("%s: pypdf module required." % (os.path.basename(sys.argv[0])))
+from helper import PROG, prog_print
 
-from helper import prog_print
+CWD = os.getcwd()
+# above this many files one directory scan replaces a stat per file
+SCAN_THRESHOLD = 32
+# path of each checked name, None when it is not a file
+RESOLVED: dict = {}
 
 
-def parse_args() -> None:
+@functools.cache
+def load_pypdf():
+    """Import pypdf on first use, help and argument errors never need it."""
+    try:
+        import pypdf
+    except ImportError:
+        sys.exit(f'{PROG}: pypdf module required.')
+    return pypdf
+
+
+def add_merge(subp, options) -> None:
+    """pdf merge subcommand."""
+    pdfmerge = subp.add_parser('merge', parents=[
+        options,
+    ])
+    pdfmerge.add_argument(dest='files', nargs='*')
+    pdfmerge.set_defaults(func=merge)
+
+
+def add_cut(subp, options) -> None:
+    """pdf cut subcommand."""
+    pdfcut = subp.add_parser('cut', parents=[
+        options,
+    ])
+    pdfcut.add_argument(dest='files', nargs=1)
+    pdfcut.add_argument(dest='positions', nargs='*', type=int)
+    pdfcut.set_defaults(func=cut)
+
+
+SUBCOMMANDS = {
+    'merge': add_merge,
+    'cut': add_cut,
+}
+
+
+def parse_args() -> tuple:
     parser = argparse.ArgumentParser(
         description='A utility program for merging and slicing pdfs')
     # universal options to be inherited by subparsers
@@ -34,32 +71,41 @@ def parse_args() -> None:
                          type=str,
                          metavar='file_name',
                          help='set a filename for the new pdf')
-    # subparser for merging
     subp = parser.add_subparsers(dest='subcommand')
-    pdfmerge = subp.add_parser('merge', parents=[
-        options,
-    ])
-    # subparser for merging
-    pdfcut = subp.add_parser('cut', parents=[
-        options,
-    ])
 
-    pdfmerge.add_argument(dest='files', nargs='*')
-    pdfcut.add_argument(dest='files', nargs=1)
-    pdfcut.add_argument(dest='positions', nargs='*', type=int)
+    # only the requested subcommand is built, help and errors need all of them
+    requested = sys.argv[1] if len(sys.argv) > 1 else None
+    for name in [requested] if requested in SUBCOMMANDS else SUBCOMMANDS:
+        SUBCOMMANDS[name](subp, options)
 
-    pdfmerge.set_defaults(func=merge)
-    pdfcut.set_defaults(func=cut)
+    return parser, parser.parse_args()
+
+
+def scan_cwd() -> None:
+    """Resolve every name in the current directory with a single scan."""
+    with os.scandir(CWD) as entries:
+        for entry in entries:
+            # the type comes from the scan, only symlinks need a stat
+            RESOLVED[entry.name] = entry.path if entry.is_file() else None
 
-    return parser.parse_args()
+
+def resolve(file: str):
+    """Path of a file in the current directory, None if it is not a file."""
+    # nested paths and case-insensitive file systems miss the scan
+    if file not in RESOLVED:
+        path = os.path.join(CWD, file)
+        RESOLVED[file] = path if os.path.isfile(path) else None
+    return RESOLVED[file]
 
 
 def all_files_exist(files: list) -> bool:
     """File validation."""
     all_exist = True
+    if len(files) > SCAN_THRESHOLD:
+        scan_cwd()
     for f in files:
-        pdf_file = f'{os.getcwd()}/{f}'
-        if not (os.path.exists(pdf_file)):
+        # only a failed lookup needs a second stat to tell directories apart
+        if resolve(f) is None and not os.path.exists(os.path.join(CWD, f)):
             prog_print(f'\'{f}\' is not found in the current directory.')
             all_exist = False
     return all_exist
@@ -68,31 +114,34 @@ def all_files_exist(files: list) -> bool:
 def cut(file: str, pos: list, **kwargs):
     """Pdf cut functionality."""
 
-    if not os.path.isfile(os.path.join(os.getcwd(), file)):
+    path = resolve(file)
+    if not path:
         prog_print(f'\'{file}\' is not a file.')
         return
 
-    new_file = PdfWriter()
-    with open(file, 'rb') as f:
-        try:
-            reader = PdfReader(f, strict=True)
-        except errors.PdfReadError as exc:
-            prog_print(f'\'{file}\' is not a pdf file.')
-            return
-        # invalid number of pages
-        if not pos or len(pos) > 2:
-            return
-        # start only means we copy one page from
-        # the page specified
-        if len(pos) < 2:
-            start = pos[0]
-            end = start + 1
-        # pages start ==> start + end
-        else:
-            start = pos[0]
-            end = start + pos[1]
-        for p in reader.pages[start:end]:
-            new_file.add_page(p)
+    pypdf = load_pypdf()
+    new_file = pypdf.PdfWriter()
+    try:
+        reader = pypdf.PdfReader(path, strict=True)
+    except pypdf.errors.PdfReadError as exc:
+        prog_print(f'\'{file}\' is not a pdf file.')
+        return
+    # invalid number of pages
+    if not pos or len(pos) > 2:
+        return
+    # start only means we copy one page from
+    # the page specified
+    if len(pos) < 2:
+        start = pos[0]
+        end = start + 1
+    # pages start ==> start + end
+    else:
+        start = pos[0]
+        end = start + pos[1]
+    # a list of indices keeps the clamping and negative starts of slicing
+    new_file.append(reader,
+                    pages=list(range(len(reader.pages))[start:end]),
+                    import_outline=False)
 
     filename = 'cut.pdf' if not kwargs.get(
         'name') else f'{kwargs.get("name")}.pdf'
@@ -102,26 +151,46 @@ def cut(file: str, pos: list, **kwargs):
 
 def merge(files: list, **kwargs) -> None:
     """Pdf merge functionality."""
-    pdf_merger = PdfMerger(strict=True)
+    # custom name
+    filename = 'merged.pdf' if not kwargs.get(
+        'name') else f'{kwargs.get("name")}.pdf'
+    # a single pdf merges into itself, copy it without parsing
+    if len(files) == 1:
+        file = files[0]
+        path = resolve(file)
+        if not path:
+            prog_print(f'\'{file}\' is not a file.')
+            return
+        with open(path, 'rb') as f:
+            is_pdf = f.read(5) == b'%PDF-'
+        if not is_pdf:
+            prog_print(f'omitted file provided: \'{file}\'')
+            return
+        try:
+            shutil.copyfile(path, filename)
+        except shutil.SameFileError:
+            pass
+        return
+
+    pypdf = load_pypdf()
+    writer = pypdf.PdfWriter()
     for file in files:
-        if not os.path.isfile(os.path.join(os.getcwd(), file)):
+        path = resolve(file)
+        if not path:
             continue
         try:
-            with open(os.path.join(os.getcwd(), file), 'rb') as f:
-                pdf_merger.append(f)
-        except errors.PdfReadError as e:
+            # strict reading as PdfMerger(strict=True) did
+            writer.append(pypdf.PdfReader(path, strict=True))
+        except pypdf.errors.PdfReadError as e:
             prog_print(f'omitted file provided: \'{file}\'')
-    # custom name
-    filename = 'merged.pdf' if not kwargs.get(
-        'name') else f'{kwargs.get("name")}.pdf'
     with open(filename, 'wb') as output:
-        pdf_merger.write(output)
+        writer.write(output)
 
 
 def main() -> None:
-    args = parse_args()
+    parser, args = parse_args()
     if not args.subcommand:
-        subprocess.run(['pdf', '-h'])
+        parser.print_help()
         return
     # no merging for less than two files
     # check that files exist